@@ -15,6 +15,7 @@ def build_pewinput():
     print(' : building pewinput')
     os.mkdir('pewinput')
     shutil.copy('src/pewinput.py', 'pewinput/__init__.py')
+    shutil.copy('src/__main__.py', 'pewinput/__main__.py')
     os.system('cc -Wall -Werror -pedantic src/pewinput.c -o pewinput/libpewinput.so -fPIC -shared')
 
 
@@ -0,0 +1,424 @@
+"""
+Command line interface of pewinput.
+
+    python -m pewinput stream --profile mouse < events.txt
+    some-generator | python -m pewinput stream --events KEY_A,KEY_B --format binary
+    python -m pewinput loadtest --devices 8 --profile keyboard --profile mouse --rate 500
+
+The stream command creates a device and writes the events it reads from stdin
+or a file (like a FIFO) to it, either as text lines like `KEY_A 1` and `SYN`
+or as raw struct input_event data.
+
+The loadtest command drives many devices for a while and reports as JSON how
+many events were sent and delivered to readers of the devices, with which
+latency and at which CPU cost.
+"""
+
+import argparse
+from array import array
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+import random
+import resource
+import sys
+import time
+from typing import Dict, Iterator, List, Tuple
+
+import pewinput
+from pewinput import (AbsInfo, Capabilities, Device, Event, EV_ABS, EV_KEY, GAMEPAD_AXES,
+                      GAMEPAD_BUTTONS, JOYSTICK_AXES, JOYSTICK_BUTTONS, KEYBOARD_CAPABILITIES,
+                      MOUSE_CAPABILITIES, REL_WHEEL, REL_X, REL_Y, SYN_DROPPED, _SYN_REPORT_PACKED,
+                      _input_event, _percentiles)
+
+
+CHUNK_SIZE = 1 << 16
+
+PROFILES = {
+    'keyboard': (KEYBOARD_CAPABILITIES, {}),
+    'mouse': (MOUSE_CAPABILITIES, {}),
+    'gamepad': (Capabilities(GAMEPAD_BUTTONS) | Capabilities(GAMEPAD_AXES), GAMEPAD_AXES),
+    'joystick': (Capabilities(JOYSTICK_BUTTONS) | Capabilities(JOYSTICK_AXES), JOYSTICK_AXES),
+}
+
+
+def event_names() -> Dict[str, Event]:
+    return {name: value for name, value in vars(pewinput).items()
+            if isinstance(value, Event) and name.isupper()}
+
+
+def create_device(args) -> Device:
+    """
+    Create the device described by --profile and --events. Absolute axis in
+    --events can carry their range like ABS_X=-100:100.
+    """
+    capabilities, absinfo = PROFILES[args.profile] if args.profile else (Capabilities(), {})
+    absinfo = dict(absinfo)
+    names = event_names()
+    extra = []
+    for spec in filter(None, (args.events or '').split(',')):
+        name, _, axis_range = spec.strip().partition('=')
+        if name not in names:
+            raise SystemExit(f'Unknown event {name}')
+        event = names[name]
+        extra.append(event)
+        if event.type == EV_ABS:
+            minimum, _, maximum = axis_range.partition(':')
+            absinfo[event] = AbsInfo(int(minimum), int(maximum)) if axis_range \
+                else AbsInfo(-32768, 32767)
+    capabilities = capabilities | extra
+    if not capabilities:
+        raise SystemExit('No events given, use --profile and/or --events')
+    return Device(capabilities, args.name, args.debug, absinfo or None)
+
+
+def read_chunks(fd: int) -> Iterator[bytes]:
+    """
+    Everything that is available on fd, as soon as it is available.
+    """
+    while True:
+        chunk = os.read(fd, CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def stream_binary(device: Device, chunks: Iterator[bytes], frame_size: int):
+    size = _input_event.size
+    # only whole frames are sent, reads can end anywhere
+    unit = size * frame_size if frame_size else size
+    rest = b''
+    for chunk in chunks:
+        if rest:
+            chunk = rest + chunk
+        end = len(chunk) - len(chunk) % unit
+        rest = chunk[end:]
+        if end:
+            device.send_array(chunk[:end] if rest else chunk, frame_size)
+    if len(rest) % size:
+        raise SystemExit(f'Input ended with an incomplete event of {len(rest) % size} bytes')
+    if rest:
+        # the last frame may be shorter
+        device.send_array(rest, frame_size)
+
+
+def stream_text(device: Device, chunks: Iterator[bytes], names: Dict[str, Event]):
+    """
+    Parse lines of `NAME VALUE` or `SYN`, # starts a comment. All frames parsed
+    from one chunk of input are written at once.
+    """
+    pack = _input_event.pack
+    resolved = {name.encode(): (event.type, event.code)
+                for name, event in names.items()}  # type: Dict[bytes, Tuple[int, int]]
+    line_number = 0
+    rest = b''
+    for chunk in chunks:
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        frames = bytearray()
+        for line in lines:
+            line_number += 1
+            fields = line.split(b'#', 1)[0].split()
+            if not fields:
+                continue
+            if fields[0] == b'SYN' and len(fields) == 1:
+                frames += _SYN_REPORT_PACKED
+                continue
+            try:
+                event_type, code = resolved[fields[0]]
+                value = int(fields[1])
+                if len(fields) != 2:
+                    raise ValueError()
+            except KeyError:
+                raise SystemExit(f'Line {line_number}: unknown event {fields[0].decode()}')
+            except (IndexError, ValueError):
+                raise SystemExit(f'Line {line_number}: expected "NAME VALUE" or "SYN"')
+            frames += pack(0, 0, event_type, code, value)
+        if frames:
+            device.send_array(frames)
+    if rest.strip():
+        raise SystemExit(f'Line {line_number + 1}: missing newline at the end of input')
+
+
+def stream(args):
+    device = create_device(args)
+    fd = sys.stdin.fileno() if args.input == '-' else os.open(args.input, os.O_RDONLY)
+    try:
+        if args.format == 'binary':
+            stream_binary(device, read_chunks(fd), args.frame_size)
+        else:
+            stream_text(device, read_chunks(fd), event_names())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        device.destroy()
+
+
+# kinds of frames a load test sends, and the default mix for each profile
+FRAME_KINDS = ('key', 'move', 'wheel', 'axis')
+DEFAULT_MIX = {
+    'keyboard': {'key': 1},
+    'mouse': {'move': 8, 'wheel': 1, 'key': 1},
+    'gamepad': {'axis': 4, 'key': 1},
+    'joystick': {'axis': 4, 'key': 1},
+}
+
+
+def frame_pool(profile: str, mix: Dict[str, float],
+               size: int = 1024) -> List[Tuple[bytes, int, int]]:
+    """
+    Packed frames to cycle through for a device of profile, as (data, events,
+    frames). Events are counted without SYN_REPORTs. Consecutive values always
+    differ, also when the pool starts over, so the kernel does not filter any
+    of them out.
+    """
+    capabilities, absinfo = PROFILES[profile]
+    keys = [event for event in capabilities if event.type == EV_KEY]
+    available = {
+        'key': bool(keys),
+        'move': REL_X in capabilities and REL_Y in capabilities,
+        'wheel': REL_WHEEL in capabilities,
+        'axis': bool(absinfo),
+    }
+    kinds = [kind for kind in mix if mix[kind] > 0 and available[kind]]
+    if not kinds:
+        raise SystemExit(f'None of the frame kinds {", ".join(mix)} fit profile {profile}')
+    weights = [mix[kind] for kind in kinds]
+    pack = _input_event.pack
+    pool = []
+    # each axis alternates between the ends of its range, starting with the end
+    # that differs from the initial value
+    ends = [(axis, (info.maximum, info.minimum) if info.value == info.minimum
+             else (info.minimum, info.maximum)) for axis, info in absinfo.items()]
+    axis_frames = 0
+
+    def axis_frame() -> Tuple[bytes, int, int]:
+        data = b''.join(pack(0, 0, EV_ABS, axis.code, values[axis_frames % 2])
+                        for axis, values in ends)
+        return data + _SYN_REPORT_PACKED, len(ends), 1
+
+    def step() -> int:
+        return random.choice((-1, 1)) * random.randint(1, 10)
+
+    for _ in range(size):
+        kind = random.choices(kinds, weights)[0]
+        if kind == 'key':
+            key = random.choice(keys)
+            data = (pack(0, 0, EV_KEY, key.code, 1) + _SYN_REPORT_PACKED
+                    + pack(0, 0, EV_KEY, key.code, 0) + _SYN_REPORT_PACKED)
+            pool.append((data, 2, 2))
+        elif kind == 'move':
+            data = (pack(0, 0, REL_X.type, REL_X.code, step())
+                    + pack(0, 0, REL_Y.type, REL_Y.code, step()) + _SYN_REPORT_PACKED)
+            pool.append((data, 2, 1))
+        elif kind == 'wheel':
+            pool.append((pack(0, 0, REL_WHEEL.type, REL_WHEEL.code, random.choice((-1, 1)))
+                         + _SYN_REPORT_PACKED, 1, 1))
+        else:
+            pool.append(axis_frame())
+            axis_frames += 1
+    if axis_frames % 2:
+        # the first axis frame of the next round has to differ from the last one
+        pool.append(axis_frame())
+    return pool
+
+
+def run_load(profiles: List[str], options: Dict) -> Dict:
+    """
+    Create devices of profiles, drive them for the configured duration and
+    count what readers of their nodes received. Runs in a worker thread or
+    process.
+    """
+    devices = []
+    delivered = []
+    drops = []
+    dropped = _input_event.pack(0, 0, SYN_DROPPED.type, SYN_DROPPED.code, 0)[-8:]
+    size = _input_event.size
+
+    def counter(index: int):
+        def count(data: bytes, received: float):
+            types = data[size - 8::size]
+            # neither SYN nor the MSC_SERIAL of latency probes
+            delivered[index] += len(types) - types.count(0) - types.count(4)
+            if dropped in data:
+                drops[index] += sum(data[offset:offset + 8] == dropped
+                                    for offset in range(size - 8, len(data), size))
+        return count
+
+    try:
+        for index, profile in enumerate(profiles):
+            capabilities, absinfo = PROFILES[profile]
+            device = Device(capabilities, f'pewinput-load-{profile}', False, absinfo or None,
+                            probe_interval=options['probe_interval'] or None, fake=options['fake'])
+            devices.append(device)
+            delivered.append(0)
+            drops.append(0)
+            device._node_reader().add_handler(counter(index))
+        pools = [frame_pool(profile, options['mix'][profile]) for profile in profiles]
+        sent_events = sent_frames = 0
+        interval = 1 / options['rate'] if options['rate'] else 0.0
+        start = time.monotonic()
+        end = start + options['duration']
+        due = [start] * len(devices)
+        # every device goes through its pool in order, see frame_pool()
+        positions = [0] * len(devices)
+        now = start
+        while now < end:
+            for index, device in enumerate(devices):
+                if due[index] <= now:
+                    pool = pools[index]
+                    data, events, frames = pool[positions[index] % len(pool)]
+                    positions[index] += 1
+                    device._write(data)
+                    sent_events += events
+                    sent_frames += frames
+                    due[index] += interval
+            now = time.monotonic()
+            if interval:
+                next_due = min(due)
+                if next_due > now:
+                    time.sleep(next_due - now)
+                    now = time.monotonic()
+        sent_time = time.monotonic() - start
+        # give readers time to catch up
+        settle = time.monotonic() + 2.0
+        while sum(delivered) < sent_events and time.monotonic() < settle:
+            time.sleep(0.01)
+        latencies = []  # type: List[float]
+        for device in devices:
+            count = min(device._latency_count, len(device._latencies))
+            latencies.extend(device._latencies[:count])
+        return {'sent_events': sent_events, 'sent_frames': sent_frames, 'sent_time': sent_time,
+                'delivered_events': sum(delivered), 'syn_dropped': sum(drops),
+                'latencies': latencies}
+    finally:
+        for device in devices:
+            device.destroy()
+
+
+def cpu_time() -> Tuple[float, float]:
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + children.ru_utime, own.ru_stime + children.ru_stime
+
+
+def loadtest(args):
+    profiles = args.profile or ['keyboard']
+    mix = {profile: dict(DEFAULT_MIX[profile]) for profile in PROFILES}
+    if args.mix:
+        weights = {}
+        for spec in args.mix.split(','):
+            kind, _, weight = spec.partition('=')
+            if kind not in FRAME_KINDS:
+                raise SystemExit(f'Unknown frame kind {kind}, choose from {", ".join(FRAME_KINDS)}')
+            weights[kind] = float(weight or 1)
+        mix = {profile: weights for profile in PROFILES}
+    options = {'rate': args.rate, 'duration': args.duration, 'fake': args.fake, 'mix': mix,
+               'probe_interval': args.probe_interval}
+    device_profiles = [profiles[index % len(profiles)] for index in range(args.devices)]
+    for profile in set(device_profiles):
+        # fail here rather than in a worker
+        frame_pool(profile, mix[profile], 1)
+    workers = max(1, min(args.workers, args.devices))
+    jobs = [(device_profiles[worker::workers], options) for worker in range(workers)]
+
+    user, system = cpu_time()
+    started = time.monotonic()
+    pool = multiprocessing.get_context('fork').Pool(workers) if args.processes \
+        else ThreadPool(workers)
+    try:
+        results = pool.starmap(run_load, jobs)
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.monotonic() - started
+    user_after, system_after = cpu_time()
+
+    sent_time = max(result['sent_time'] for result in results)
+
+    def per_second(count: int) -> float:
+        return count / sent_time if sent_time else 0.0
+    sent = sum(result['sent_events'] for result in results)
+    delivered = sum(result['delivered_events'] for result in results)
+    latencies = array('d', (latency for result in results for latency in result['latencies']))
+    report = {
+        'devices': args.devices,
+        'profiles': sorted(set(device_profiles)),
+        'workers': workers,
+        'mode': 'processes' if args.processes else 'threads',
+        'fake': args.fake,
+        'duration': sent_time,
+        'sent': {
+            'events': sent,
+            'frames': sum(result['sent_frames'] for result in results),
+            'events_per_second': per_second(sent),
+        },
+        'delivered': {
+            'events': delivered,
+            'events_per_second': per_second(delivered),
+        },
+        'lost_events': sent - delivered,
+        'syn_dropped': sum(result['syn_dropped'] for result in results),
+        'latency': {f'p{p}': value for p, value in
+                    _percentiles(latencies, len(latencies), (50, 90, 99, 99.9)).items()},
+        'cpu': {
+            'user': user_after - user,
+            'system': system_after - system,
+            'percent': 100 * (user_after - user + system_after - system) / elapsed,
+        },
+    }
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pewinput',
+                                     description='Emulate input devices via uinput.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    stream_parser = commands.add_parser('stream', help='create a device and write events read from '
+                                                       'stdin or a file to it')
+    stream_parser.add_argument('--profile', choices=sorted(PROFILES),
+                               help='events of a common device type')
+    stream_parser.add_argument('--events', help='comma separated event names like KEY_A,REL_X, '
+                                                'absolute axis may have a range: ABS_X=0:255')
+    stream_parser.add_argument('--name', help='name of the device')
+    stream_parser.add_argument('--format', choices=('text', 'binary'), default='text',
+                               help='text lines like "KEY_A 1" and "SYN", or raw struct '
+                                    'input_event data (default: text)')
+    stream_parser.add_argument('--frame-size', type=int, default=0,
+                               help='binary only: insert a SYN_REPORT after every N events')
+    stream_parser.add_argument('--input', default='-', help='file or FIFO to read (default: stdin)')
+    stream_parser.add_argument('--debug', action='store_true',
+                               help='check events against the capabilities of the device')
+    stream_parser.set_defaults(run=stream)
+
+    load_parser = commands.add_parser('loadtest', help='drive many devices and report throughput, '
+                                                       'latency and drops as JSON')
+    load_parser.add_argument('--devices', type=int, default=1, help='number of devices')
+    load_parser.add_argument('--profile', action='append', choices=sorted(PROFILES),
+                             help='profile of the devices, repeat to alternate between profiles '
+                                  '(default: keyboard)')
+    load_parser.add_argument('--rate', type=float, default=0,
+                             help='frames per second per device, 0 for as fast as possible')
+    load_parser.add_argument('--duration', type=float, default=10, help='seconds to send')
+    load_parser.add_argument('--mix', help='weights of the frame kinds to send, like '
+                                           'move=8,key=1 (kinds: ' + ', '.join(FRAME_KINDS) + ')')
+    load_parser.add_argument('--workers', type=int, default=1,
+                             help='threads (or processes) the devices are split among')
+    load_parser.add_argument('--processes', action='store_true',
+                             help='run workers as processes instead of threads')
+    load_parser.add_argument('--probe-interval', type=int, default=100,
+                             help='measure the latency of every Nth write, 0 to turn off')
+    load_parser.add_argument('--fake', action='store_true',
+                             help='write into pipes instead of uinput, works without root')
+    load_parser.set_defaults(run=loadtest)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,66 +7,179 @@ int open_uinput(void) {
     return uinput_fd;
 }
 
-int enable_event(int uinput_fd, uint16_t event_type, uint16_t event_code) {
-    unsigned long input_type;
+static int set_bit_request(uint16_t event_type, unsigned long* request) {
     switch (event_type) {
         case EV_KEY:
-            ioctl(uinput_fd, UI_SET_EVBIT, EV_REP);
-            input_type = UI_SET_KEYBIT;
+            *request = UI_SET_KEYBIT;
             break;
         case EV_REL:
-            input_type = UI_SET_RELBIT;
+            *request = UI_SET_RELBIT;
             break;
         case EV_ABS:
-            input_type = UI_SET_ABSBIT;
+            *request = UI_SET_ABSBIT;
             break;
         case EV_MSC:
-            input_type = UI_SET_MSCBIT;
+            *request = UI_SET_MSCBIT;
             break;
         case EV_SW:
-            input_type = UI_SET_SWBIT;
+            *request = UI_SET_SWBIT;
             break;
         case EV_LED:
-            input_type = UI_SET_LEDBIT;
+            *request = UI_SET_LEDBIT;
             break;
         case EV_SND:
-            input_type = UI_SET_SNDBIT;
+            *request = UI_SET_SNDBIT;
             break;
         case EV_FF:
-            input_type = UI_SET_FFBIT;
+            *request = UI_SET_FFBIT;
             break;
+        default:
+            return -1;
+    }
+    return 0;
+}
+
+int enable_events(int uinput_fd, uint16_t event_type, const uint8_t* bits, size_t nbytes) {
+    unsigned long input_type;
+    size_t byte;
+    int bit;
+    if (set_bit_request(event_type, &input_type))
+        return -1;
+    if (event_type == EV_KEY && ioctl(uinput_fd, UI_SET_EVBIT, EV_REP))
+        return -1;
+    if (ioctl(uinput_fd, UI_SET_EVBIT, event_type))
+        return -1;
+    for (byte = 0; byte < nbytes; byte++) {
+        if (!bits[byte])
+            continue;
+        for (bit = 0; bit < 8; bit++) {
+            if ((bits[byte] >> bit) & 1 && ioctl(uinput_fd, input_type, byte * 8 + bit))
+                return -1;
+        }
     }
-    ioctl(uinput_fd, UI_SET_EVBIT, event_type);
-    return ioctl(uinput_fd, input_type, event_code);
+    return 0;
+}
+
+int setup_abs(int uinput_fd, uint16_t code, int32_t value, int32_t minimum, int32_t maximum,
+              int32_t fuzz, int32_t flat, int32_t resolution) {
+    struct uinput_abs_setup abs_setup;
+    memset(&abs_setup, 0, sizeof(abs_setup));
+    abs_setup.code = code;
+    abs_setup.absinfo.value = value;
+    abs_setup.absinfo.minimum = minimum;
+    abs_setup.absinfo.maximum = maximum;
+    abs_setup.absinfo.fuzz = fuzz;
+    abs_setup.absinfo.flat = flat;
+    abs_setup.absinfo.resolution = resolution;
+    return ioctl(uinput_fd, UI_ABS_SETUP, &abs_setup);
 }
 
-int create_device(int uinput_fd, const char* name) {
+int setup_device(int uinput_fd, const char* name) {
     struct uinput_setup usetup;
     memset(&usetup, 0, sizeof(usetup));
     usetup.id.bustype = BUS_USB;
     usetup.id.vendor = 0x0;
     usetup.id.product = 0x0;
-    strcpy(usetup.name, name);
+    strncpy(usetup.name, name, UINPUT_MAX_NAME_SIZE - 1);
 
-    ioctl(uinput_fd, UI_DEV_SETUP, &usetup);
-    int err = ioctl(uinput_fd, UI_DEV_CREATE);
-    sleep(1);
-    return err;
+    if (ioctl(uinput_fd, UI_DEV_SETUP, &usetup))
+        return -1;
+    return ioctl(uinput_fd, UI_DEV_CREATE);
+}
+
+int device_sysname(int uinput_fd, char* buffer, size_t length) {
+    return ioctl(uinput_fd, UI_GET_SYSNAME(length), buffer);
+}
+
+int write_events(int uinput_fd, const void* buffer, size_t nbytes) {
+    const char* data = buffer;
+    while (nbytes) {
+        ssize_t written = write(uinput_fd, data, nbytes);
+        if (written < 0) {
+            if (errno == EINTR)
+                continue;
+            return -1;
+        }
+        data += written;
+        nbytes -= written;
+    }
+    return 0;
+}
+
+int write_many(const int* uinput_fds, size_t count, const void* buffer, size_t nbytes, int* errors) {
+    size_t i;
+    int failed = 0;
+    for (i = 0; i < count; i++) {
+        errors[i] = write_events(uinput_fds[i], buffer, nbytes) ? errno : 0;
+        if (errors[i])
+            failed++;
+    }
+    return failed;
+}
+
+static int write_iov(int uinput_fd, struct iovec* iov, int iovcnt) {
+    while (iovcnt) {
+        ssize_t written = writev(uinput_fd, iov, iovcnt);
+        if (written < 0) {
+            if (errno == EINTR)
+                continue;
+            return -1;
+        }
+        while (iovcnt && (size_t) written >= iov->iov_len) {
+            written -= iov->iov_len;
+            iov++;
+            iovcnt--;
+        }
+        if (iovcnt) {
+            iov->iov_base = (char*) iov->iov_base + written;
+            iov->iov_len -= written;
+        }
+    }
+    return 0;
+}
+
+int write_frames(int uinput_fd, const void* events, size_t count, size_t frame_size) {
+    /* all zero is EV_SYN, SYN_REPORT, 0 */
+    static struct input_event syn_report;
+    struct iovec iov[FRAMES_PER_WRITE * 2];
+    const struct input_event* event = events;
+    if (!frame_size)
+        return write_events(uinput_fd, events, count * sizeof(struct input_event));
+    while (count) {
+        int iovcnt = 0;
+        while (count && iovcnt < FRAMES_PER_WRITE * 2) {
+            size_t length = count < frame_size ? count : frame_size;
+            iov[iovcnt].iov_base = (void*) event;
+            iov[iovcnt].iov_len = length * sizeof(struct input_event);
+            iov[iovcnt + 1].iov_base = &syn_report;
+            iov[iovcnt + 1].iov_len = sizeof(syn_report);
+            iovcnt += 2;
+            event += length;
+            count -= length;
+        }
+        if (write_iov(uinput_fd, iov, iovcnt))
+            return -1;
+    }
+    return 0;
 }
 
-void send_event(int uinput_fd, uint16_t event_type, uint16_t event_code, int32_t event_value) {
-    struct input_event event;
-    event.type = event_type;
-    event.code = event_code;
-    event.value = event_value;
-    event.time.tv_sec = 0;
-    event.time.tv_usec = 0;
+int sleep_until(double deadline) {
+    struct timespec until;
+    int err;
+    until.tv_sec = (time_t) deadline;
+    until.tv_nsec = (long) ((deadline - (double) until.tv_sec) * 1e9);
+    do {
+        err = clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, &until, NULL);
+    } while (err == EINTR);
+    return err;
+}
 
-    write(uinput_fd, &event, sizeof(event));
+int lock_memory(const void* address, size_t length) {
+    return mlock(address, length);
 }
 
-void flush(int uinput_fd) {
-    send_event(uinput_fd, EV_SYN, SYN_REPORT, 0);
+int unlock_memory(const void* address, size_t length) {
+    return munlock(address, length);
 }
 
 int destroy_device(int uinput_fd) {
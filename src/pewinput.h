@@ -1,16 +1,31 @@
 
+#include <errno.h>
 #include <stdint.h>
 #include <string.h>
+#include <time.h>
 #include <fcntl.h>
 #include <unistd.h>
+#include <sys/mman.h>
+#include <sys/uio.h>
 
 #include <linux/uinput.h>
 
 
+/* number of frames handed to the kernel per writev call */
+#define FRAMES_PER_WRITE 256
+
+
 extern int open_uinput(void);
-extern int enable_event(int uinput_fd, uint16_t event_type, uint16_t event_code);
-extern int create_device(int uinput_fd, const char* name);
-extern void send_event(int uinput_fd, uint16_t event_type, uint16_t event_code, int32_t event_value);
-extern void flush(int uinput_fd);
+extern int enable_events(int uinput_fd, uint16_t event_type, const uint8_t* bits, size_t nbytes);
+extern int setup_abs(int uinput_fd, uint16_t code, int32_t value, int32_t minimum, int32_t maximum,
+                     int32_t fuzz, int32_t flat, int32_t resolution);
+extern int setup_device(int uinput_fd, const char* name);
+extern int device_sysname(int uinput_fd, char* buffer, size_t length);
+extern int write_events(int uinput_fd, const void* buffer, size_t nbytes);
+extern int write_many(const int* uinput_fds, size_t count, const void* buffer, size_t nbytes, int* errors);
+extern int write_frames(int uinput_fd, const void* events, size_t count, size_t frame_size);
+extern int sleep_until(double deadline);
+extern int lock_memory(const void* address, size_t length);
+extern int unlock_memory(const void* address, size_t length);
 extern int destroy_device(int uinput_fd);
 extern int close_uinput(int uinput_fd);
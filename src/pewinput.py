@@ -1,11 +1,46 @@
 
+import os
 from os.path import dirname, join
+from array import array
 from ctypes import *
-
-from typing import List, Optional
+from functools import lru_cache
+import gc
+import glob
+import heapq
+import itertools
+import mmap
+import queue
+import select
+import struct
+import threading
+import time
+import warnings
+import weakref
+
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 pew = cdll.LoadLibrary(join(dirname(__file__), 'libpewinput.so'))
+pew.enable_events.argtypes = [c_int, c_uint16, c_char_p, c_size_t]
+pew.write_events.argtypes = [c_int, c_void_p, c_size_t]
+pew.write_frames.argtypes = [c_int, c_void_p, c_size_t, c_size_t]
+pew.write_many.argtypes = [POINTER(c_int), c_size_t, c_void_p, c_size_t, POINTER(c_int)]
+pew.device_sysname.argtypes = [c_int, c_char_p, c_size_t]
+pew.sleep_until.argtypes = [c_double]
+pew.lock_memory.argtypes = [c_void_p, c_size_t]
+pew.unlock_memory.argtypes = [c_void_p, c_size_t]
+
+# struct input_event with a zero timestamp, the kernel fills in the time
+_input_event = struct.Struct('llHHi')
+
+# numpy layout of struct input_event, for Device.send_array
+INPUT_EVENT_DTYPE = numpy.dtype([('sec', 'l'), ('usec', 'l'), ('type', 'u2'), ('code', 'u2'),
+                                 ('value', 'i4')]) if numpy else None
 
 
 class Event:
@@ -18,6 +53,14 @@ class Event:
         self.type = event_type
         self.code = code
 
+    def __eq__(self, other):
+        if not isinstance(other, Event):
+            return NotImplemented
+        return self.type == other.type and self.code == other.code
+
+    def __hash__(self):
+        return hash((self.type, self.code))
+
     def __repr__(self):
         return f'Event<type: {self.type}, code: {self.code}>'
 
@@ -34,32 +77,234 @@ class Key(Event):
         return f'Key<type: {self.type}, code: {self.code}>'
 
 
+class AbsInfo(NamedTuple):
+    """
+    Range and noise handling of an absolute axis, see struct input_absinfo.
+    """
+
+    minimum: int
+    maximum: int
+    fuzz: int = 0
+    flat: int = 0
+    resolution: int = 0
+    value: int = 0
+
+
+class Capabilities:
+    """
+    The set of events a device is able to send, stored as one bitset per event
+    type. Capabilities can be combined with the usual set operators
+    (|, &, -, ^) to build profiles and are meant to be reused: the packed
+    bitsets handed to the kernel are only built once per instance.
+    """
+
+    __slots__ = ('_bits', '_packed', '_hash')
+
+    def __init__(self, events: Iterable[Event] = ()):
+        bits = {}  # type: Dict[int, int]
+        for event in events:
+            bits[event.type] = bits.get(event.type, 0) | (1 << event.code)
+        self._bits = bits
+        self._packed = None  # type: Optional[List[Tuple[int, bytes]]]
+        self._hash = None  # type: Optional[int]
+
+    @classmethod
+    def _from_bits(cls, bits: Dict[int, int]) -> 'Capabilities':
+        capabilities = cls()
+        capabilities._bits = {event_type: mask for event_type, mask in bits.items() if mask}
+        return capabilities
+
+    def has(self, event_type: int, code: int) -> bool:
+        return bool(self._bits.get(event_type, 0) >> code & 1)
+
+    @property
+    def types(self) -> List[int]:
+        return sorted(self._bits)
+
+    def packed(self) -> List[Tuple[int, bytes]]:
+        """
+        The bitset of every event type as little endian bytes, which is the
+        layout the c library expects. Cached after the first call.
+        """
+        if self._packed is None:
+            self._packed = [(event_type, mask.to_bytes((mask.bit_length() + 7) // 8, 'little'))
+                            for event_type, mask in sorted(self._bits.items())]
+        return self._packed
+
+    def __contains__(self, event: Event) -> bool:
+        return bool(self._bits.get(event.type, 0) >> event.code & 1)
+
+    def __iter__(self) -> Iterator[Event]:
+        for event_type, mask in sorted(self._bits.items()):
+            code = 0
+            while mask:
+                if mask & 1:
+                    yield Key(code) if event_type == EV_KEY else Event(event_type, code)
+                mask >>= 1
+                code += 1
+
+    def __len__(self):
+        return sum(bin(mask).count('1') for mask in self._bits.values())
+
+    def __bool__(self):
+        return bool(self._bits)
+
+    def _combine(self, other: 'Capabilities', operation) -> 'Capabilities':
+        if not isinstance(other, Capabilities):
+            other = Capabilities(other)
+        return Capabilities._from_bits({
+            event_type: operation(self._bits.get(event_type, 0), other._bits.get(event_type, 0))
+            for event_type in set(self._bits) | set(other._bits)
+        })
+
+    def __or__(self, other):
+        return self._combine(other, lambda a, b: a | b)
+
+    def __and__(self, other):
+        return self._combine(other, lambda a, b: a & b)
+
+    def __sub__(self, other):
+        return self._combine(other, lambda a, b: a & ~b)
+
+    def __xor__(self, other):
+        return self._combine(other, lambda a, b: a ^ b)
+
+    def __eq__(self, other):
+        if not isinstance(other, Capabilities):
+            return NotImplemented
+        return self._bits == other._bits
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(frozenset(self._bits.items()))
+        return self._hash
+
+    def __repr__(self):
+        return f'Capabilities<{len(self)} events of types {self.types}>'
+
+
 class _UInput:
     """
     An interface to the pewinput c library.
     """
 
     @staticmethod
-    def create_device(name: str, events: List[Event]) -> int:
+    def create_device(name: str, capabilities: Capabilities,
+                      absinfo: Optional[Dict[Event, AbsInfo]] = None) -> int:
         fd = pew.open_uinput()
+        if fd < 0:
+            raise RuntimeError(f'Could not open /dev/uinput for device {name}. Are you root?')
+        try:
+            _UInput.setup_device(fd, name, capabilities, absinfo)
+        except RuntimeError:
+            pew.close_uinput(fd)
+            raise
+        return fd
+
+    @staticmethod
+    def setup_device(fd: int, name: str, capabilities: Capabilities,
+                     absinfo: Optional[Dict[Event, AbsInfo]] = None):
         try:
-            for event in events:
-                if pew.enable_event(fd, event.type, event.code):
+            for event_type, bits in capabilities.packed():
+                if pew.enable_events(fd, event_type, bits, len(bits)):
                     raise RuntimeError()
-            if pew.create_device(fd, name):
+            for axis, info in (absinfo or {}).items():
+                if pew.setup_abs(fd, axis.code, info.value, info.minimum, info.maximum,
+                                 info.fuzz, info.flat, info.resolution):
+                    raise RuntimeError()
+            if pew.setup_device(fd, name.encode()):
                 raise RuntimeError()
         except RuntimeError:
-            pew.close_uinput(fd)
             raise RuntimeError(f'Could not create device {name}. Are you root?')
-        return fd
 
     @staticmethod
-    def send_event(fd: int, event: Event, value: int):
-        pew.send_event(fd, event.type, event.code, value)
+    def reconfigure_device(fd: int, name: str, capabilities: Capabilities,
+                           absinfo: Optional[Dict[Event, AbsInfo]] = None):
+        """
+        Replace the device on an open uinput fd. The kernel starts over with an
+        empty device after UI_DEV_DESTROY, so everything is registered again.
+        """
+        if pew.destroy_device(fd):
+            raise RuntimeError(f'Error on destroying device on {fd}')
+        _UInput.setup_device(fd, name, capabilities, absinfo)
+
+    @staticmethod
+    def wait_for_node(fd: int, timeout: float = 1.0) -> Optional[str]:
+        """
+        Wait until the event node of a freshly created device exists and udev
+        is done with it. Returns the path of the node, or None on kernels that
+        can not tell the node, where a fixed second is waited instead.
+        Within timeout, the second the devices always waited before, the node
+        is returned even if udev did not get to it (like in containers without
+        udevd), and None if it never showed up (like in containers that only
+        got /dev/uinput).
+        """
+        sysname = create_string_buffer(64)
+        if pew.device_sysname(fd, sysname, len(sysname)) < 0:
+            time.sleep(1)
+            return None
+        sysfs = join('/sys/devices/virtual/input', sysname.value.decode())
+        deadline = time.monotonic() + timeout
+        while True:
+            node, settled = _UInput._ready_node(sysfs)
+            if settled or time.monotonic() > deadline:
+                return node
+            time.sleep(0.001)
+
+    @staticmethod
+    def _ready_node(sysfs: str) -> Tuple[Optional[str], bool]:
+        """
+        The event node of a device if it exists, and whether udev is done
+        with it.
+        """
+        try:
+            event = next(entry for entry in os.listdir(sysfs) if entry.startswith('event'))
+            with open(join(sysfs, event, 'dev')) as dev:
+                device_number = dev.read().strip()
+        except (OSError, StopIteration):
+            return None, False
+        node = join('/dev/input', event)
+        if not os.path.exists(node):
+            return None, False
+        udev_data = '/run/udev/data'
+        if os.path.isdir(udev_data) and not os.path.exists(join(udev_data, f'c{device_number}')):
+            return node, False
+        return node, True
+
+    @staticmethod
+    def write(fd: int, data: bytes):
+        if pew.write_events(fd, data, len(data)):
+            raise RuntimeError(f'Could not write events to device on {fd}')
 
     @staticmethod
-    def flush(fd: int):
-        pew.flush(fd)
+    def write_many(fds: Array, data: bytes, errors: Array) -> int:
+        """
+        Write the same events to all fds. Returns the number of failed fds,
+        errors holds the errno of each fd or 0.
+        """
+        return pew.write_many(fds, len(fds), data, len(data), errors)
+
+    @staticmethod
+    def write_frames(fd: int, events: memoryview, frame_size: int):
+        """
+        Write a buffer of packed input events without copying it, inserting a
+        SYN_REPORT after every frame_size events if frame_size is not 0.
+        """
+        if events.readonly:
+            # ctypes can only point into writable buffers, so read-only numpy arrays
+            # (like memmaps) are passed by their address and whole bytes as is
+            source = events.obj
+            if numpy is not None and isinstance(source, numpy.ndarray) \
+                    and source.flags.c_contiguous and events.nbytes == source.nbytes:
+                address = source.ctypes.data
+            elif type(source) is bytes and events.nbytes == len(source):
+                address = source
+            else:
+                address = events.tobytes()
+        else:
+            address = (c_char * events.nbytes).from_buffer(events)
+        if pew.write_frames(fd, address, len(events) // _input_event.size, frame_size):
+            raise RuntimeError(f'Could not write events to device on {fd}')
 
     @staticmethod
     def destroy_device(fd: int):
@@ -68,85 +313,1550 @@ class _UInput:
         pew.close_uinput(fd)
 
 
+class _FakeUInput(_UInput):
+    """
+    Stands in for uinput without needing root: devices write into a pipe, and
+    the other end of the pipe is their event node.
+    """
+
+    _readers = {}  # type: Dict[int, int]
+
+    @staticmethod
+    def create_device(name: str, capabilities: Capabilities,
+                      absinfo: Optional[Dict[Event, AbsInfo]] = None) -> int:
+        reader, writer = os.pipe()
+        _FakeUInput._readers[writer] = reader
+        return writer
+
+    @staticmethod
+    def reconfigure_device(fd: int, name: str, capabilities: Capabilities,
+                           absinfo: Optional[Dict[Event, AbsInfo]] = None):
+        pass
+
+    @staticmethod
+    def wait_for_node(fd: int, timeout: float = 1.0) -> Optional[str]:
+        return f'/proc/{os.getpid()}/fd/{_FakeUInput._readers[fd]}'
+
+    @staticmethod
+    def destroy_device(fd: int):
+        os.close(_FakeUInput._readers.pop(fd))
+        os.close(fd)
+
+
+def _insert_syn_reports(events: memoryview, frame_size: int) -> bytes:
+    """
+    The events with a SYN_REPORT after every frame_size of them, like the c
+    library writes them.
+    """
+    size = frame_size * _input_event.size
+    frames = (events[offset:offset + size] for offset in range(0, len(events), size))
+    return _SYN_REPORT_PACKED.join(frames) + _SYN_REPORT_PACKED
+
+
+class _Deadline:
+    """
+    A re-armable one shot timer. All expirations run on one background thread
+    that is started lazily, so arming it often does not create a thread each
+    time. Only a weak reference to the callback is kept.
+    """
+
+    def __init__(self, callback):
+        self._callback = weakref.WeakMethod(callback)
+        self._condition = threading.Condition()
+        self._deadline = None  # type: Optional[float]
+        self._thread = None  # type: Optional[threading.Thread]
+        self._stopped = False
+
+    def arm(self, delay: float):
+        """
+        Run the callback after delay seconds, unless the timer is already armed.
+        """
+        with self._condition:
+            if self._deadline is not None or self._stopped:
+                return
+            self._deadline = time.monotonic() + delay
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='pewinput-deadline',
+                                                daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def cancel(self):
+        with self._condition:
+            self._deadline = None
+
+    def stop(self):
+        with self._condition:
+            self._deadline = None
+            self._stopped = True
+            self._condition.notify()
+
+    def _run(self):
+        with self._condition:
+            while not self._stopped:
+                if self._deadline is None:
+                    self._condition.wait()
+                    continue
+                remaining = self._deadline - time.monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+                self._deadline = None
+                callback = self._callback()
+                if callback is None:
+                    return
+                self._condition.release()
+                try:
+                    callback()
+                finally:
+                    del callback
+                    self._condition.acquire()
+
+
+def _percentiles(samples: array, count: int, percentiles: Iterable[float]) -> Dict[float, float]:
+    """
+    Percentiles of a ring buffer of samples that count samples were written to.
+    """
+    ordered = sorted(samples[:min(count, len(samples))])
+    if not ordered:
+        return {}
+    return {p: ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)] for p in percentiles}
+
+
+def set_realtime(priority: int = 50, cpus: Optional[Iterable[int]] = None) -> bool:
+    """
+    Run the calling thread with SCHED_FIFO at the given priority and, if cpus
+    are given, only on those cores. Warns and returns False if the process
+    lacks the privilege (CAP_SYS_NICE) or priority or cpus are invalid instead
+    of failing.
+    """
+    try:
+        if cpus is not None:
+            os.sched_setaffinity(0, set(cpus))
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+    except PermissionError:
+        warnings.warn('Not allowed to use real-time scheduling, continuing without')
+        return False
+    except OSError as error:
+        warnings.warn(f'Could not use real-time scheduling ({error}), continuing without')
+        return False
+    return True
+
+
+# running real-time writers that keep garbage collection off the hot path, and
+# how many of them disabled it completely
+_gc_holders = 0
+_gc_disablers = 0
+_gc_thresholds = (700, 10, 10)
+_gc_was_enabled = False
+_gc_lock = threading.Lock()
+
+
+def _hold_gc(disable: bool):
+    global _gc_holders, _gc_disablers, _gc_thresholds, _gc_was_enabled
+    with _gc_lock:
+        if not _gc_holders:
+            # objects that exist by now are never looked at again by the collector,
+            # and it runs far less often
+            _gc_thresholds = gc.get_threshold()
+            if hasattr(gc, 'freeze'):
+                gc.freeze()
+            gc.set_threshold(max(_gc_thresholds[0], 50000), *_gc_thresholds[1:])
+        _gc_holders += 1
+        if disable:
+            if not _gc_disablers:
+                _gc_was_enabled = gc.isenabled()
+                gc.disable()
+            _gc_disablers += 1
+
+
+def _release_gc(disable: bool):
+    global _gc_holders, _gc_disablers
+    with _gc_lock:
+        if disable:
+            _gc_disablers -= 1
+            if not _gc_disablers and _gc_was_enabled:
+                gc.enable()
+        _gc_holders -= 1
+        if not _gc_holders:
+            gc.set_threshold(*_gc_thresholds)
+            if hasattr(gc, 'unfreeze'):
+                gc.unfreeze()
+
+
+class RealtimeWriter:
+    """
+    A dedicated thread that writes the frames of one or more devices with low
+    latency. It runs with real-time priority on the given cpus, writes from
+    preallocated (and locked) buffers and keeps garbage collection short while
+    it runs. Without the privilege for any of that it warns and continues as a
+    normal thread.
+
+    Garbage collection is a matter of the whole process: while any real-time
+    writer runs, all objects that existed at its start are frozen (gc.freeze)
+    and the collector runs much less often. With disable_gc=True it does not
+    run at all, so reference cycles are never freed until every such writer
+    is stopped. Call stop() when done with a writer, the collector is restored
+    once no writer runs anymore.
+
+    Pass it as writer to a Device. The time from handing a frame to the writer
+    until it was written is measured, see percentiles(). A writer with
+    realtime=False measures the same for comparison.
+    """
+
+    def __init__(self, priority: int = 50, cpus: Optional[Iterable[int]] = None,
+                 realtime: bool = True, slots: int = 1024, slot_size: int = 64,
+                 samples: int = 65536, disable_gc: bool = False):
+        self.priority = priority
+        self.cpus = cpus
+        self.realtime = realtime
+        self.disable_gc = disable_gc
+        self.errors = []  # type: List[Exception]
+        # slot_size is counted in events, frames are split up over slots if needed
+        self._slot_bytes = slot_size * _input_event.size
+        self._buffer = bytearray(slots * self._slot_bytes)
+        self._view = memoryview(self._buffer)
+        self._c_buffer = (c_char * len(self._buffer)).from_buffer(self._buffer)
+        self._address = addressof(self._c_buffer)
+        self._fds = array('i', [0]) * slots
+        self._lengths = array('l', [0]) * slots
+        self._submitted = array('d', [0.0]) * slots
+        self._samples = array('d', [0.0]) * samples
+        self._sample_count = 0
+        self._head = 0
+        self._tail = 0
+        self._condition = threading.Condition()
+        self._thread = None  # type: Optional[threading.Thread]
+        self._running = False
+        self._locked = False
+
+    def start(self) -> 'RealtimeWriter':
+        if self._thread is None:
+            self._running = True
+            if self.realtime:
+                self._locked = not pew.lock_memory(self._address, len(self._buffer))
+                if not self._locked:
+                    warnings.warn('Not allowed to lock memory, continuing without')
+                _hold_gc(self.disable_gc)
+            self._thread = threading.Thread(target=self._run, name='pewinput-writer', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._thread.join()
+        self._thread = None
+        if self._locked:
+            pew.unlock_memory(self._address, len(self._buffer))
+            self._locked = False
+        if self.realtime:
+            _release_gc(self.disable_gc)
+
+    def submit(self, fd: int, data: bytes):
+        """
+        Queue packed events for writing to fd, blocking while all slots are
+        in use.
+        """
+        if self.errors:
+            raise self.errors.pop(0)
+        slots = len(self._fds)
+        size = self._slot_bytes
+        with self._condition:
+            for offset in range(0, len(data), size):
+                while self._head - self._tail == slots:
+                    self._check_alive()
+                    self._condition.wait()
+                self._check_alive()
+                chunk = data[offset:offset + size]
+                slot = self._head % slots
+                self._view[slot * size:slot * size + len(chunk)] = chunk
+                self._fds[slot] = fd
+                self._lengths[slot] = len(chunk)
+                self._submitted[slot] = time.perf_counter()
+                self._head += 1
+            self._condition.notify_all()
+
+    def drain(self):
+        """
+        Wait until everything submitted so far is written.
+        """
+        with self._condition:
+            while self._tail != self._head and self._thread is not None:
+                self._check_alive()
+                self._condition.wait()
+
+    def _check_alive(self):
+        if self._thread is None or not self._thread.is_alive():
+            raise RuntimeError('The writer thread is not running')
+
+    def percentiles(self, percentiles: Iterable[float] = (50, 90, 99, 99.9)) -> Dict[float, float]:
+        """
+        Latency from submit until written, in seconds, over the most recent
+        frames.
+        """
+        return _percentiles(self._samples, self._sample_count, percentiles)
+
+    def _run(self):
+        try:
+            self._write_slots()
+        finally:
+            # wake up anyone waiting on a thread that is gone
+            with self._condition:
+                self._condition.notify_all()
+
+    def _write_slots(self):
+        if self.realtime:
+            set_realtime(self.priority, self.cpus)
+        slots = len(self._fds)
+        size = self._slot_bytes
+        samples = self._samples
+        fds = self._fds
+        lengths = self._lengths
+        submitted = self._submitted
+        condition = self._condition
+        while True:
+            with condition:
+                while self._tail == self._head and self._running:
+                    condition.wait()
+                if self._tail == self._head:
+                    return
+                tail = self._tail
+                head = self._head
+            for index in range(tail, head):
+                slot = index % slots
+                if pew.write_events(fds[slot], self._address + slot * size, lengths[slot]):
+                    self.errors.append(RuntimeError(f'Could not write events to device on '
+                                                    f'{fds[slot]}'))
+                samples[self._sample_count % len(samples)] = time.perf_counter() - submitted[slot]
+                self._sample_count += 1
+            with condition:
+                self._tail = head
+                condition.notify_all()
+
+
+class JournalRecord(NamedTuple):
+    """
+    The events one device wrote with one syscall and when (time.monotonic()).
+    """
+
+    timestamp: float
+    device_id: int
+    data: bytes
+
+    def events(self) -> List[Tuple[int, int, int]]:
+        """
+        The recorded events as (type, code, value).
+        """
+        return [event[2:] for event in _input_event.iter_unpack(self.data)]
+
+
+class Journal:
+    """
+    An append-only binary record of everything devices wrote, for audits and
+    postmortems. The packed frames are appended as they are written, together
+    with a monotonic timestamp and the id of the device, to memory mapped
+    segment files named path.0, path.1, ... of segment_size bytes each. When a
+    segment is full the next one is started, and with max_segments only that
+    many of the most recent segments are kept.
+    Use read() to iterate over the records of a journal.
+    """
+
+    _header = struct.Struct('<dII')  # timestamp, device id, length of data
+
+    def __init__(self, path: str, segment_size: int = 64 << 20, max_segments: Optional[int] = None):
+        self.path = path
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self._lock = threading.Lock()
+        self._segments = self._segment_indices(path)
+        self._map = None  # type: Optional[mmap.mmap]
+        self._file = None
+        self._offset = 0
+        self._open_segment(self._segments[-1] + 1 if self._segments else 0, segment_size)
+
+    @staticmethod
+    def _segment_indices(path: str) -> List[int]:
+        suffixes = (name[len(path) + 1:] for name in glob.glob(glob.escape(path) + '.*'))
+        return sorted(int(suffix) for suffix in suffixes if suffix.isdigit())
+
+    def _open_segment(self, index: int, size: int):
+        self._close_segment()
+        self._file = open(f'{self.path}.{index}', 'w+b')
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._offset = 0
+        self._segments.append(index)
+        while self.max_segments and len(self._segments) > self.max_segments:
+            os.remove(f'{self.path}.{self._segments.pop(0)}')
+
+    def _close_segment(self):
+        if self._map is None:
+            return
+        self._map.close()
+        self._file.truncate(self._offset)
+        self._file.close()
+        self._map = None
+
+    def append(self, device_id: int, data: bytes):
+        if not len(data):
+            # a length of 0 marks the unused rest of a segment
+            return
+        header = self._header
+        length = header.size + len(data)
+        with self._lock:
+            if self._map is None:
+                raise ValueError(f'Journal {self.path} is closed')
+            if self._offset + length > len(self._map):
+                self._open_segment(self._segments[-1] + 1, max(self.segment_size, length))
+            offset = self._offset
+            header.pack_into(self._map, offset, time.monotonic(), device_id, len(data))
+            self._map[offset + header.size:offset + length] = data
+            self._offset = offset + length
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+
+    def __del__(self):
+        self.close()
+
+    @classmethod
+    def read(cls, path: str) -> Iterator[JournalRecord]:
+        """
+        Iterate over the records of all segments of the journal at path, oldest
+        first.
+        """
+        header = cls._header
+        for index in cls._segment_indices(path):
+            with open(f'{path}.{index}', 'rb') as segment:
+                data = segment.read()
+            offset = 0
+            while offset + header.size <= len(data):
+                timestamp, device_id, length = header.unpack_from(data, offset)
+                if not length:
+                    # rest of a segment that was not closed properly
+                    break
+                offset += header.size
+                yield JournalRecord(timestamp, device_id, data[offset:offset + length])
+                offset += length
+
+
+class _NodeReader:
+    """
+    Reads what a device reports on its own evdev node on a background thread
+    and hands every read, with the time it was received, to its handlers.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        self._handlers = []  # type: List[Callable[[bytes, float], None]]
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='pewinput-reader', daemon=True)
+        self._thread.start()
+
+    def add_handler(self, handler: Callable[[bytes, float], None]):
+        self._handlers = self._handlers + [handler]
+
+    def close(self):
+        if self._running:
+            self._running = False
+            self._thread.join()
+            os.close(self._fd)
+
+    def _run(self):
+        poll = select.poll()
+        poll.register(self._fd, select.POLLIN)
+        size = _input_event.size * 1024
+        while self._running:
+            if not poll.poll(100):
+                continue
+            try:
+                data = os.read(self._fd, size)
+            except BlockingIOError:
+                continue
+            except OSError:
+                return
+            if not data:
+                return
+            received = time.monotonic()
+            for handler in self._handlers:
+                handler(data, received)
+
+
+class RateController:
+    """
+    Finds the highest event rate (events per second) readers keep up with,
+    AIMD style: each interval without dropped events the rate grows by
+    increase, a drop multiplies it with decrease. wait() delays the sender
+    so the current rate is not exceeded.
+    """
+
+    def __init__(self, rate: float = 10000.0, increase: float = 1000.0, decrease: float = 0.5,
+                 interval: float = 0.1, minimum_rate: float = 100.0):
+        self.rate = rate
+        self.increase = increase
+        self.decrease = decrease
+        self.interval = interval
+        self.minimum_rate = minimum_rate
+        self.drops = 0
+        self._lock = threading.Lock()
+        self._next_send = 0.0
+        self._last_increase = time.monotonic()
+        self._last_decrease = float('-inf')
+
+    def dropped(self):
+        """
+        Report a SYN_DROPPED. Several drops within one interval count as one
+        congestion event.
+        """
+        with self._lock:
+            self.drops += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= self.interval:
+                self.rate = max(self.minimum_rate, self.rate * self.decrease)
+                self._last_decrease = now
+
+    def wait(self, events: int):
+        """
+        Block until events more events may be sent.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - max(self._last_increase, self._last_decrease) >= self.interval:
+                self.rate += self.increase
+                self._last_increase = now
+            delay = self._next_send - now
+            self._next_send = max(self._next_send, now) + events / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
+
+@lru_cache(maxsize=1024)
+def _compile_shortcuts(expression: str, capabilities: Capabilities) -> bytes:
+    """
+    Pack comma separated key combinations into press and release frames,
+    checking that the device with capabilities has all the keys.
+    """
+    frames = []
+    for combination in expression.split(','):
+        keys = []
+        for name in combination.split('+'):
+            name = name.strip().lower()
+            if name not in _KEY_NAMES:
+                raise ValueError(f'Unknown key "{name}" in shortcut "{expression}"')
+            key = _KEY_NAMES[name]
+            if key not in capabilities:
+                raise ValueError(f'{key} ({name}) of shortcut "{expression}" is not enabled on the '
+                                 f'device')
+            keys.append(key)
+        frames += [_input_event.pack(0, 0, key.type, key.code, 1) for key in keys]
+        frames.append(_SYN_REPORT_PACKED)
+        frames += [_input_event.pack(0, 0, key.type, key.code, 0) for key in reversed(keys)]
+        frames.append(_SYN_REPORT_PACKED)
+    return b''.join(frames)
+
+
 class Device:
     """
     A virtual input device like a keyboard, mouse or controller, depending of the
     registered events.
     DO NOT try to create "super devices" that combine multiple use cases. Things
     like registering relative and absolute axis on one device will likely fail.
+
+    With debug enabled, every sent event is checked against the capabilities of
+    the device and a ValueError is raised for events the device cannot send.
+
+    If a batch_deadline (in seconds) is given, complete frames are not written
+    right away but collected until batch_size events are buffered or the
+    deadline after the first buffered frame expired. flush() always writes
+    immediately.
+
+    Creating a device returns once its event node (see node) is ready.
+
+    With a RealtimeWriter as writer, frames are written by its thread.
+    With a Journal, everything the device writes is also appended to it.
+    monitor_drops() adapts the send rate to what readers of the device keep
+    up with.
+
+    With probe_interval, every probe_interval-th write is tagged with an
+    MSC_SERIAL sequence number (the device gets that capability), which a
+    reader of the event node matches to measure the latency from writing until
+    delivery to readers, see latency_percentiles().
+
+    Devices with keys let the kernel repeat held keys. repeat sets the delay
+    and period of that in milliseconds, see set_repeat() and hold().
+
+    A fake device needs no uinput (nor root), it writes into a pipe whose
+    other end is its node. Useful to test what drives devices, as long as
+    something reads the node, or writes block once the pipe is full.
     """
 
     count = 0
 
-    def __init__(self, event_list: List[Event], name: Optional[str] = None):
-        self.name = (name or 'pewinput-virtual-dev') + f'{Device.count}'
-        self.fd = _UInput.create_device(self.name, event_list)
+    def __init__(self, event_list: Union[List[Event], Capabilities], name: Optional[str] = None,
+                 debug: bool = False, absinfo: Optional[Dict[Event, AbsInfo]] = None,
+                 batch_deadline: Optional[float] = None, batch_size: int = 64,
+                 writer: Optional[RealtimeWriter] = None, journal: Optional[Journal] = None,
+                 probe_interval: Optional[int] = None, repeat: Optional[Tuple[int, int]] = None,
+                 fake: bool = False):
+        self.id = Device.count
+        self.name = (name or 'pewinput-virtual-dev') + f'{self.id}'
+        if not isinstance(event_list, Capabilities):
+            event_list = Capabilities(event_list)
+        if probe_interval:
+            event_list = event_list | [MSC_SERIAL]
+        self.capabilities = event_list
+        self.absinfo = absinfo
+        self.debug = debug
+        self.batch_deadline = batch_deadline
+        self.batch_size = batch_size
+        self.writer = writer.start() if writer else None
+        self.journal = journal
+        self.rate_controller = None  # type: Optional[RateController]
+        self._reader = None  # type: Optional[_NodeReader]
+        self.probe_interval = probe_interval
+        self._probe_writes = 0
+        self._probe_sequence = 0
+        self._probe_sent = {}  # type: Dict[int, float]
+        # the reader thread matches probes while the sending thread adds them
+        self._probe_lock = threading.Lock()
+        self._latencies = array('d', [0.0]) * 4096
+        self._latency_count = 0
+        self._holds = {}  # type: Dict[Event, threading.Timer]
+        self._pending = bytearray()
+        self._lock = threading.RLock()
+        self._batch_timer = _Deadline(self._flush_batch) if batch_deadline is not None else None
+        self._uinput = _FakeUInput if fake else _UInput
+        self.fd = -1
+        self.fd = self._uinput.create_device(self.name, self.capabilities, absinfo)
         Device.count += 1
+        self.node = self._uinput.wait_for_node(self.fd)
+        if probe_interval:
+            self._node_reader().add_handler(self._match_probes)
+        if repeat:
+            self.set_repeat(*repeat)
+
+    def reconfigure(self, event_list: Union[List[Event], Capabilities], name: Optional[str] = None,
+                    absinfo: Optional[Dict[Event, AbsInfo]] = None):
+        """
+        Turn this device into one with other events (and name), reusing the open
+        uinput file descriptor. Nothing happens if neither changed, otherwise
+        returns once the new event node is ready.
+        """
+        if not isinstance(event_list, Capabilities):
+            event_list = Capabilities(event_list)
+        if self.probe_interval:
+            event_list = event_list | [MSC_SERIAL]
+        name = self.name if name is None else name + f'{self.id}'
+        if event_list == self.capabilities and name == self.name and absinfo == self.absinfo:
+            return
+        with self._lock:
+            self._write_pending()
+            if self.writer:
+                self.writer.drain()
+            self._uinput.reconfigure_device(self.fd, name, event_list, absinfo)
+            self.name = name
+            self.capabilities = event_list
+            self.absinfo = absinfo
+            self.node = self._uinput.wait_for_node(self.fd)
+            if self._reader:
+                handlers = self._reader._handlers
+                self._reader.close()
+                self._reader = _NodeReader(self.node)
+                for handler in handlers:
+                    self._reader.add_handler(handler)
+
+    def _node_reader(self) -> _NodeReader:
+        if self._reader is None:
+            if self.node is None:
+                raise RuntimeError(f'The event node of device {self.name} is unknown')
+            self._reader = _NodeReader(self.node)
+        return self._reader
+
+    def monitor_drops(self, controller: Optional[RateController] = None) -> RateController:
+        """
+        Watch the event node of this device for SYN_DROPPED, which the kernel
+        reports when a reader's buffer overflowed, and let controller limit the
+        send rate of this device accordingly. The reader of the monitor stands
+        in for the real consumers.
+        Returns the controller, its rate and drops attributes tell the current
+        rate and the number of drops.
+        """
+        self.rate_controller = controller or RateController()
+        dropped = _input_event.pack(0, 0, EV_SYN, SYN_DROPPED.code, 0)[-8:]
+        controller = self.rate_controller
+
+        def handle(data: bytes, received: float):
+            size = _input_event.size
+            for offset in range(size - 8, len(data), size):
+                if data[offset:offset + 8] == dropped:
+                    controller.dropped()
+        self._node_reader().add_handler(handle)
+        return self.rate_controller
+
+    def latency_percentiles(self, percentiles: Iterable[float] = (50, 90, 99, 99.9)
+                            ) -> Dict[float, float]:
+        """
+        Latency from writing until a reader of the event node received the
+        events, in seconds, over the most recent probes (see probe_interval).
+        """
+        return _percentiles(self._latencies, self._latency_count, percentiles)
+
+    def _tag_probe(self, data: bytes) -> bytes:
+        """
+        Put a sequence number in front of the events and remember when they
+        were sent. Must hold the lock.
+        """
+        sequence = self._probe_sequence = (self._probe_sequence + 1) & 0x7fffffff
+        sent = self._probe_sent
+        with self._probe_lock:
+            if len(sent) >= 1024:
+                # the oldest probe got lost, e.g. because no SYN_REPORT followed
+                del sent[next(iter(sent))]
+            sent[sequence] = time.monotonic()
+        return _input_event.pack(0, 0, EV_MSC, MSC_SERIAL.code, sequence) + data
+
+    def _match_probes(self, data: bytes, received: float):
+        size = _input_event.size
+        marker = _probe_marker
+        offset = data.find(marker)
+        while offset != -1:
+            start = offset - (size - 8)
+            if start % size == 0:
+                sequence = _input_event.unpack_from(data, start)[4]
+                with self._probe_lock:
+                    sent = self._probe_sent.pop(sequence, None)
+                if sent is not None:
+                    self._latencies[self._latency_count % len(self._latencies)] = received - sent
+                    self._latency_count += 1
+            offset = data.find(marker, offset + 1)
 
     def send_event(self, event: Event, value: int, flush: bool = True):
-        _UInput.send_event(self.fd, event, value)
-        if flush:
-            self.flush()
+        if self.debug and event.type != EV_SYN and event not in self.capabilities:
+            raise ValueError(f'{event} is not enabled on device {self.name}')
+        with self._lock:
+            self._pending += _input_event.pack(0, 0, event.type, event.code, value)
+            if flush:
+                self._sync()
+
+    def send_array(self, events, frame_size: int = 0):
+        """
+        Send many events at once without creating python objects for them.
+        events is a numpy array of INPUT_EVENT_DTYPE or any other buffer laid
+        out as struct input_event, it is handed to the kernel without a copy.
+        Structured arrays with type, code and value fields in another layout and
+        integer arrays of shape (N, 3) with type, code and value columns are
+        packed once.
+        If frame_size is given, a SYN_REPORT is inserted after every frame_size
+        events, otherwise the events have to contain their own SYN_REPORTs.
+        """
+        if numpy is not None and isinstance(events, numpy.ndarray):
+            if events.dtype != INPUT_EVENT_DTYPE:
+                fields = ('type', 'code', 'value')
+                if events.dtype.names and set(fields) <= set(events.dtype.names):
+                    columns = [events[field] for field in fields]
+                elif (events.dtype.kind in 'iu' and events.ndim == 2
+                      and events.shape[1] == len(fields)):
+                    columns = [events[:, index] for index in range(len(fields))]
+                else:
+                    raise ValueError(f'Can not send array of {events.dtype} with shape '
+                                     f'{events.shape}, expected INPUT_EVENT_DTYPE, fields type, '
+                                     f'code and value or integer columns of shape (N, 3)')
+                packed = numpy.zeros(len(events), INPUT_EVENT_DTYPE)
+                for field, column in zip(fields, columns):
+                    packed[field] = column
+                events = packed
+            events = numpy.ascontiguousarray(events)
+        view = memoryview(events).cast('B')
+        if view.nbytes % _input_event.size:
+            raise ValueError(f'Buffer size {view.nbytes} is not a multiple of the input event size '
+                             f'{_input_event.size}')
+        if self.debug:
+            for _, _, event_type, code, _ in _input_event.iter_unpack(view):
+                if event_type != EV_SYN and not self.capabilities.has(event_type, code):
+                    raise ValueError(f'{Event(event_type, code)} is not enabled on device '
+                                     f'{self.name}')
+        with self._lock:
+            self._write_pending()
+            if self.writer:
+                self.writer.drain()
+            if self.journal:
+                self.journal.append(self.id, _insert_syn_reports(view, frame_size) if frame_size
+                                    else view)
+            if self.rate_controller:
+                count = len(view) // _input_event.size
+                self.rate_controller.wait(count + (count // frame_size if frame_size else 0))
+            _UInput.write_frames(self.fd, view, frame_size)
 
     def press(self, key: Key, flush: bool = True):
         self.send_event(key, 1, flush)
 
     def release(self, key: Key, flush: bool = True):
+        if self._holds:
+            self._cancel_hold(key)
         self.send_event(key, 0, flush)
 
+    def hold(self, key: Key, duration: float):
+        """
+        Press key now and release it after duration seconds, without blocking.
+        In between the kernel repeats the key like for a real keyboard, so
+        only the press and release are sent. Holding a key again extends the
+        hold, releasing it ends the hold early.
+        """
+        with self._lock:
+            self._cancel_hold(key)
+            timer = threading.Timer(duration, self._end_hold, (key,))
+            timer.daemon = True
+            self._holds[key] = timer
+            self.press(key)
+            timer.start()
+
+    def _cancel_hold(self, key: Key):
+        timer = self._holds.pop(key, None)
+        if timer:
+            timer.cancel()
+
+    def _end_hold(self, key: Key):
+        with self._lock:
+            if self._holds.get(key) is threading.current_thread() and self.fd != -1:
+                self.release(key)
+
+    def set_repeat(self, delay: int, period: int):
+        """
+        Set after how many milliseconds the kernel starts to repeat held keys
+        and the milliseconds between repeats. A period of 0 turns repeating off.
+        """
+        with self._lock:
+            self._pending += _input_event.pack(0, 0, EV_REP, REP_DELAY.code, delay)
+            self._pending += _input_event.pack(0, 0, EV_REP, REP_PERIOD.code, period)
+            self._sync()
+
     def click(self, key: Key, flush: bool = True):
         self.send_event(key, 1, False)
         self.send_event(key, 0, flush)
 
     def click_combination(self, keys: List[Key]):
-        for key in keys:
-            self.press(key, False)
-        self.flush()
-        for key in keys:
-            self.release(key, False)
-        self.flush()
+        with self._lock:
+            for key in keys:
+                self.press(key, False)
+            self._sync()
+            for key in keys:
+                self.release(key, False)
+            self._sync()
+
+    def shortcut(self, expression: str):
+        """
+        Press and release a combination of keys like "ctrl+shift+t". Keys are
+        named like their constants with or without KEY_ ("a", "f5", "leftctrl",
+        "BTN_LEFT") or by common names like ctrl, shift, alt, super, enter and
+        esc.
+        """
+        self.send_keys(expression)
+
+    def send_keys(self, expression: str):
+        """
+        Send several shortcuts one after the other, like "ctrl+c, ctrl+v".
+        Expressions are compiled to packed frames once and then cached, keys
+        missing on the device raise a ValueError.
+        """
+        self._write(_compile_shortcuts(expression, self.capabilities))
 
     def flush(self):
         """
         Actually make send events being processed. Already called by other
         functions by default.
+        Also writes all batched frames immediately.
+        """
+        with self._lock:
+            if self._pending[-_input_event.size:] != _SYN_REPORT_PACKED:
+                self._pending += _SYN_REPORT_PACKED
+            self._write_pending()
+
+    def _flush_buffered(self):
+        """
+        Write whatever this device holds back, without sending an empty frame
+        if there is nothing.
+        """
+        with self._lock:
+            if self._pending:
+                self.flush()
+
+    def _sync(self):
+        """
+        End the current frame. It is written right away or, when batching, once
+        the batch is full or its deadline expired.
+        """
+        with self._lock:
+            self._pending += _SYN_REPORT_PACKED
+            self._commit()
+
+    def _write(self, frame: bytes):
+        """
+        Send already packed input events of a complete frame, ending with a
+        SYN_REPORT.
+        """
+        with self._lock:
+            self._pending += frame
+            self._commit()
+
+    def _commit(self):
+        if self._batch_timer and len(self._pending) < self.batch_size * _input_event.size:
+            self._batch_timer.arm(self.batch_deadline)
+        else:
+            self._write_pending()
+
+    def _flush_batch(self):
+        with self._lock:
+            if self.fd != -1:
+                self._write_pending()
+
+    def _write_pending(self):
         """
-        _UInput.flush(self.fd)
+        Write all pending events with a single syscall. Must hold the lock.
+        """
+        if not self._pending:
+            return
+        if self._batch_timer:
+            self._batch_timer.cancel()
+        data = bytes(self._pending)
+        self._pending.clear()
+        if self.probe_interval:
+            self._probe_writes += 1
+            if self._probe_writes >= self.probe_interval:
+                self._probe_writes = 0
+                data = self._tag_probe(data)
+        if self.journal:
+            self.journal.append(self.id, data)
+        if self.rate_controller:
+            self.rate_controller.wait(len(data) // _input_event.size)
+        if self.writer:
+            self.writer.submit(self.fd, data)
+        else:
+            _UInput.write(self.fd, data)
 
     def destroy(self):
         if self.fd == -1:
             return
-        try:
-            _UInput.destroy_device(self.fd)
-        except RuntimeError:
-            raise RuntimeError(f'Could not destroy device: {self}')
-        self.fd = -1
+        with self._lock:
+            if self._batch_timer:
+                self._batch_timer.stop()
+            if self._holds:
+                for key in list(self._holds):
+                    self.release(key, False)
+                self._sync()
+            self._write_pending()
+            if self.writer:
+                self.writer.drain()
+            if self._reader:
+                self._reader.close()
+                self._reader = None
+            try:
+                self._uinput.destroy_device(self.fd)
+            except RuntimeError:
+                raise RuntimeError(f'Could not destroy device: {self}')
+            self.fd = -1
 
     def __del__(self):
         self.destroy()
 
 
+class DeviceGroup:
+    """
+    A group of devices that all send the very same frames, like the seats of a
+    test farm. Frames are packed once and written to every member in a single
+    loop of the c library. A member that fails does not keep the others from
+    receiving the frame, flush() returns its error instead.
+    Events buffered by the members themselves, including frames queued on
+    their writers, are written before. Group frames go straight to the members
+    though, past their writers, rate controllers and latency probes.
+    """
+
+    def __init__(self, devices: Iterable[Device] = ()):
+        self.devices = []  # type: List[Device]
+        self._pending = bytearray()
+        self._lock = threading.Lock()
+        self._fds = (c_int * 0)()
+        self._errors = (c_int * 0)()
+        for device in devices:
+            self.add(device)
+
+    def add(self, device: Device):
+        with self._lock:
+            self.devices.append(device)
+            self._update_fds()
+
+    def remove(self, device: Device):
+        with self._lock:
+            self.devices.remove(device)
+            self._update_fds()
+
+    def _update_fds(self):
+        self._fds = (c_int * len(self.devices))(*(device.fd for device in self.devices))
+        self._errors = (c_int * len(self.devices))()
+
+    def send_event(self, event: Event, value: int, flush: bool = True) -> Dict[Device, OSError]:
+        with self._lock:
+            self._pending += _input_event.pack(0, 0, event.type, event.code, value)
+        return self.flush() if flush else {}
+
+    def press(self, key: Key, flush: bool = True) -> Dict[Device, OSError]:
+        return self.send_event(key, 1, flush)
+
+    def release(self, key: Key, flush: bool = True) -> Dict[Device, OSError]:
+        return self.send_event(key, 0, flush)
+
+    def click(self, key: Key, flush: bool = True) -> Dict[Device, OSError]:
+        self.send_event(key, 1, False)
+        return self.send_event(key, 0, flush)
+
+    def move_relative(self, x: int, y: int, flush: bool = True) -> Dict[Device, OSError]:
+        self.send_event(REL_X, x, False)
+        return self.send_event(REL_Y, y, flush)
+
+    def flush(self) -> Dict[Device, OSError]:
+        """
+        End the frame and write it to every member. Returns the error of each
+        member the frame could not be written to.
+        """
+        with self._lock:
+            self._pending += _SYN_REPORT_PACKED
+            data = bytes(self._pending)
+            self._pending.clear()
+            fds = self._fds
+            for index, device in enumerate(self.devices):
+                device._flush_buffered()
+                if device.fd != fds[index]:
+                    # never write to a file descriptor a destroyed member left behind
+                    fds[index] = device.fd
+            for writer in {device.writer for device in self.devices if device.writer}:
+                # keep the order of frames the writers still hold
+                writer.drain()
+            failed = _UInput.write_many(self._fds, data, self._errors)
+            for device, error in zip(self.devices, self._errors):
+                if device.journal and not error:
+                    device.journal.append(device.id, data)
+            if not failed:
+                return {}
+            return {device: OSError(error, os.strerror(error))
+                    for device, error in zip(self.devices, self._errors) if error}
+
+
 class Mouse(Device):
     """
     A virtual input device with three buttons and x, y and wheel axis.
+
+    If a report_rate (in Hz) is given, relative movements are coalesced: the
+    deltas of all moves are summed up and sent as at most one frame per report
+    interval, like a real mouse would. Button events and flush() send the
+    pending movement first, so the order of motion and clicks is kept.
     """
 
-    def __init__(self, name: str = None):
+    def __init__(self, name: str = None, debug: bool = False, report_rate: Optional[float] = None,
+                 **kwargs):
         if not name:
             name = 'pewinput-virtual-mouse'
-        super(Mouse, self).__init__([BTN_LEFT, BTN_MIDDLE, BTN_RIGHT,
-                                     REL_X, REL_Y, REL_WHEEL, REL_HWHEEL], name)
+        super(Mouse, self).__init__(MOUSE_CAPABILITIES, name, debug, **kwargs)
+        self.report_rate = report_rate
+        self._motion = [0, 0, 0, 0]  # x, y, wheel, hwheel
+        self._next_report = 0.0
+        self._report_timer = _Deadline(self._report_motion) if report_rate else None
 
     def move_relative(self, x: int, y: int, flush: bool = True):
+        if self._report_timer:
+            self._coalesce(x, y, 0, 0)
+            return
         self.send_event(REL_X, x, False)
         self.send_event(REL_Y, y, flush)
 
     def move_wheel(self, value, flush: bool = True):
+        if self._report_timer:
+            self._coalesce(0, 0, value, 0)
+            return
         self.send_event(REL_WHEEL, value, flush)
 
     def move_hwheel(self, value, flush: bool = True):
+        if self._report_timer:
+            self._coalesce(0, 0, 0, value)
+            return
         self.send_event(REL_HWHEEL, value, flush)
 
+    def send_event(self, event: Event, value: int, flush: bool = True):
+        with self._lock:
+            if self._report_timer and event.type == EV_KEY:
+                self._send_motion(time.monotonic())
+            super(Mouse, self).send_event(event, value, flush)
+
+    def flush(self):
+        with self._lock:
+            if self._report_timer:
+                self._send_motion(time.monotonic())
+            super(Mouse, self).flush()
+
+    def _flush_buffered(self):
+        with self._lock:
+            if self._report_timer:
+                self._send_motion(time.monotonic())
+            super(Mouse, self)._flush_buffered()
+
+    def destroy(self):
+        if self.fd != -1 and self._report_timer:
+            self._report_timer.stop()
+            with self._lock:
+                self._send_motion(time.monotonic())
+        super(Mouse, self).destroy()
+
+    def _coalesce(self, x: int, y: int, wheel: int, hwheel: int):
+        with self._lock:
+            motion = self._motion
+            motion[0] += x
+            motion[1] += y
+            motion[2] += wheel
+            motion[3] += hwheel
+            now = time.monotonic()
+            if now >= self._next_report:
+                self._send_motion(now)
+            else:
+                self._report_timer.arm(self._next_report - now)
+
+    def _report_motion(self):
+        with self._lock:
+            self._send_motion(time.monotonic())
+
+    def _send_motion(self, now: float):
+        """
+        Send the summed up movement as one frame. Must hold the lock.
+        """
+        motion = self._motion
+        if not any(motion):
+            return
+        frame = [_input_event.pack(0, 0, EV_REL, axis.code, value)
+                 for axis, value in zip(_MOUSE_AXES, motion) if value]
+        frame.append(_SYN_REPORT_PACKED)
+        self._motion = [0, 0, 0, 0]
+        self._next_report = now + 1 / self.report_rate
+        self._write(b''.join(frame))
+
+
+class _Controller(Device):
+    """
+    A virtual input device with buttons and absolute axis that remembers the
+    current value of each of them.
+    """
+
+    def __init__(self, buttons: List[Key], axes: Dict[Event, AbsInfo], name: str, debug: bool,
+                 **kwargs):
+        super(_Controller, self).__init__(Capabilities(buttons) | Capabilities(axes), name, debug,
+                                          axes, **kwargs)
+        self._state = {button: 0 for button in buttons}  # type: Dict[Event, int]
+        self._state.update((axis, info.value) for axis, info in axes.items())
+
+    @property
+    def state(self) -> Dict[Event, int]:
+        return dict(self._state)
+
+    def send_event(self, event: Event, value: int, flush: bool = True):
+        super(_Controller, self).send_event(event, value, flush)
+        if event in self._state:
+            self._state[event] = value
+
+    def update(self, state: Dict[Event, int]) -> int:
+        """
+        Apply a (full or partial) snapshot of button and axis values. Only the
+        values that differ from the current state are sent, all of them in a
+        single frame. Nothing is sent if nothing changed.
+        Returns the number of sent events.
+        """
+        current = self._state
+        unknown = [event for event in state if event not in current]
+        if unknown:
+            raise ValueError(f'{unknown[0]} is not a button or axis of device {self.name}')
+        changed = {event: value for event, value in state.items() if current[event] != value}
+        if not changed:
+            return 0
+        self._write(b''.join(_input_event.pack(0, 0, event.type, event.code, value)
+                             for event, value in changed.items()) + _SYN_REPORT_PACKED)
+        # only remember what was actually written
+        current.update(changed)
+        return len(changed)
+
+
+class Gamepad(_Controller):
+    """
+    A virtual gamepad with face, shoulder, menu and stick buttons, two analog
+    sticks, two analog triggers and a digital pad reported as hat axis.
+    """
+
+    def __init__(self, name: str = None, buttons: Optional[List[Key]] = None,
+                 axes: Optional[Dict[Event, AbsInfo]] = None, debug: bool = False, **kwargs):
+        super(Gamepad, self).__init__(GAMEPAD_BUTTONS if buttons is None else buttons,
+                                      GAMEPAD_AXES if axes is None else axes,
+                                      name or 'pewinput-virtual-gamepad', debug, **kwargs)
+
+
+class Joystick(_Controller):
+    """
+    A virtual flight stick with trigger, thumb and base buttons, x and y axis,
+    twist, throttle and a hat switch.
+    """
+
+    def __init__(self, name: str = None, buttons: Optional[List[Key]] = None,
+                 axes: Optional[Dict[Event, AbsInfo]] = None, debug: bool = False, **kwargs):
+        super(Joystick, self).__init__(JOYSTICK_BUTTONS if buttons is None else buttons,
+                                       JOYSTICK_AXES if axes is None else axes,
+                                       name or 'pewinput-virtual-joystick', debug, **kwargs)
+
+
+# A frame is the list of (type, code, value) events between two SYN_REPORTs
+Frame = List[Tuple[int, int, int]]
+
+
+def read_frames(path: str) -> Iterator[List[Frame]]:
+    """
+    The frames an evdev node (/dev/input/eventN) reports, in chunks of what
+    one read returned.
+    """
+    size = _input_event.size
+    frame = []  # type: Frame
+    with open(path, 'rb', buffering=0) as node:
+        while True:
+            data = node.read(size * 256)
+            if not data:
+                return
+            chunk = []
+            for _, _, event_type, code, value in _input_event.iter_unpack(data):
+                if event_type == EV_SYN and code == SYN_REPORT.code:
+                    chunk.append(frame)
+                    frame = []
+                elif event_type != EV_SYN:
+                    frame.append((event_type, code, value))
+            if chunk:
+                yield chunk
+
+
+class Pipeline:
+    """
+    A lazily evaluated chain of transformations from a source of frames into a
+    device. Frames flow through the stages in chunks, so each stage costs one
+    call per chunk of frames instead of one per event, and the sink writes a
+    whole chunk with one syscall:
+
+        Pipeline.from_journal('recording').scale(REL_X, 2).remap({KEY_A: KEY_B}).run(device)
+
+    Stages only pull as many chunks as are consumed. buffer() decouples a
+    slow source from the rest by running it in a thread, with a bounded queue
+    in between.
+    """
+
+    def __init__(self, frames: Iterable[Frame] = (), chunk_size: int = 256,
+                 chunks: Optional[Iterable[List[Frame]]] = None):
+        if chunks is None:
+            frames = iter(frames)
+            chunks = iter(lambda: list(itertools.islice(frames, chunk_size)), [])
+        self._chunks = chunks
+
+    @classmethod
+    def from_journal(cls, path: str, device_id: Optional[int] = None) -> 'Pipeline':
+        """
+        Replay the frames recorded in a Journal, optionally of one device only.
+        """
+        def chunks():
+            for record in Journal.read(path):
+                if device_id is None or record.device_id == device_id:
+                    frames = _split_frames(record.events())
+                    if frames:
+                        yield frames
+        return cls(chunks=chunks())
+
+    @classmethod
+    def from_device(cls, path: str) -> 'Pipeline':
+        """
+        The frames reported by an evdev node, like the node of another Device.
+        """
+        return cls(chunks=read_frames(path))
+
+    def __iter__(self) -> Iterator[Frame]:
+        for chunk in self._chunks:
+            yield from chunk
+
+    def chunks(self) -> Iterator[List[Frame]]:
+        return iter(self._chunks)
+
+    def map_chunks(self, function: Callable[[List[Frame]], List[Frame]]) -> 'Pipeline':
+        """
+        Add a stage that transforms whole chunks of frames at once.
+        """
+        return Pipeline(chunks=(result for result in map(function, self._chunks) if result))
+
+    def map(self, function: Callable[[Frame], Optional[Frame]]) -> 'Pipeline':
+        """
+        Add a stage that transforms frames, frames it returns None or an empty
+        frame for are dropped.
+        """
+        return self.map_chunks(lambda chunk: [result for result in map(function, chunk) if result])
+
+    def filter(self, predicate: Callable[[Frame], bool]) -> 'Pipeline':
+        return self.map_chunks(lambda chunk: [frame for frame in chunk if predicate(frame)])
+
+    def drop(self, events: Iterable[Event]) -> 'Pipeline':
+        """
+        Remove the given events from all frames.
+        """
+        dropped = {(event.type, event.code) for event in events}
+        return self.map(lambda frame: [event for event in frame if event[:2] not in dropped])
+
+    def remap(self, mapping: Dict[Event, Event]) -> 'Pipeline':
+        """
+        Replace events by others, like keys of one layout by another.
+        """
+        table = {(old.type, old.code): (new.type, new.code) for old, new in mapping.items()}
+        return self.map(lambda frame: [table.get(event[:2], event[:2]) + event[2:]
+                                       for event in frame])
+
+    def scale(self, event: Event, factor: float) -> 'Pipeline':
+        """
+        Multiply the values of an event, like the deltas of a mouse axis.
+        """
+        key = (event.type, event.code)
+        return self.map(lambda frame: [(t, c, round(v * factor)) if (t, c) == key else (t, c, v)
+                                       for t, c, v in frame])
+
+    def clamp(self, event: Event, minimum: int, maximum: int) -> 'Pipeline':
+        key = (event.type, event.code)
+        return self.map(lambda frame: [(t, c, min(max(v, minimum), maximum)) if (t, c) == key
+                                       else (t, c, v) for t, c, v in frame])
+
+    def rate_limit(self, frames_per_second: float) -> 'Pipeline':
+        """
+        Let at most frames_per_second frames pass, delaying the rest.
+        """
+        interval = 1 / frames_per_second
+
+        def chunks(upstream):
+            due = time.monotonic()
+            for chunk in upstream:
+                for frame in chunk:
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    due = max(due, time.monotonic() - interval) + interval
+                    yield [frame]
+        return Pipeline(chunks=chunks(self._chunks))
+
+    def buffer(self, size: int = 16) -> 'Pipeline':
+        """
+        Evaluate everything before this stage in a thread, with at most size
+        chunks waiting for the stages after it.
+        """
+        chunks = queue.Queue(size)  # type: queue.Queue
+        end = object()
+
+        def produce(upstream):
+            try:
+                for chunk in upstream:
+                    chunks.put(chunk)
+                chunks.put(end)
+            except BaseException as error:
+                chunks.put(error)
+
+        def consume():
+            threading.Thread(target=produce, args=(self._chunks,), name='pewinput-pipeline',
+                             daemon=True).start()
+            while True:
+                chunk = chunks.get()
+                if chunk is end:
+                    return
+                if isinstance(chunk, BaseException):
+                    raise chunk
+                yield chunk
+        return Pipeline(chunks=consume())
+
+    def run(self, device: Device) -> int:
+        """
+        Send all frames to device, each chunk with a single write. Returns the
+        number of sent frames.
+        """
+        pack = _input_event.pack
+        count = 0
+        for chunk in self._chunks:
+            data = bytearray()
+            for frame in chunk:
+                for event_type, code, value in frame:
+                    data += pack(0, 0, event_type, code, value)
+                data += _SYN_REPORT_PACKED
+            device.send_array(data)
+            count += len(chunk)
+        return count
+
+
+def _pack_frame(frame: Union[Frame, bytes]) -> bytes:
+    if isinstance(frame, bytes):
+        return frame
+    pack = _input_event.pack
+    return b''.join([pack(0, 0, event_type, code, value) for event_type, code, value in frame]
+                    + [_SYN_REPORT_PACKED])
+
+
+class Scheduler:
+    """
+    Sends the frames of many devices at given times, from a single thread.
+
+    Frames are scheduled at offsets in seconds from the start of run(), one by
+    one with schedule() or as whole time ordered sources with add_source() and
+    add_journal(), which are only read as far as needed. A heap keeps the
+    frames in order, the dispatching thread sleeps until the absolute time the
+    next frame is due and sends all frames due within the same tick together,
+    with one write per device. Frames can be scheduled and the scheduler can be
+    stopped from other threads while it runs.
+    How late frames were sent is reported by lateness().
+    """
+
+    # the last stretch before a frame is due is slept precisely, without
+    # waking up for new frames or stop()
+    _precise_sleep = 0.002
+
+    def __init__(self, tick: float = 0.0005, samples: int = 65536):
+        self.tick = tick
+        self._condition = threading.Condition()
+        self._heap = []  # type: List[tuple]
+        self._sources = []  # type: List[Iterator[Tuple[float, Device, Union[Frame, bytes]]]]
+        self._sequence = itertools.count()
+        self._lateness = array('d', [0.0]) * samples
+        self._sent = 0
+        self._running = False
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def schedule(self, offset: float, device: Device, frame: Union[Frame, bytes]):
+        """
+        Send frame, a list of (type, code, value) or already packed events
+        ending with a SYN_REPORT, to device at offset seconds after the start.
+        """
+        entry = (offset, next(self._sequence), device, _pack_frame(frame), -1)
+        with self._condition:
+            heapq.heappush(self._heap, entry)
+            self._condition.notify_all()
+
+    def add_source(self, frames: Iterable[Tuple[float, Device, Union[Frame, bytes]]]):
+        """
+        Schedule (offset, device, frame) tuples ordered by offset, like from a
+        generator, reading only as far ahead as needed.
+        """
+        with self._condition:
+            self._sources.append(iter(frames))
+            self._pull(len(self._sources) - 1)
+            self._condition.notify_all()
+
+    def add_journal(self, path: str, devices: Dict[int, Device], offset: float = 0.0):
+        """
+        Replay a Journal with its original timing, starting at offset. devices
+        maps the recorded device ids to the devices to send to, records of
+        other devices are skipped.
+        """
+        def frames():
+            start = None
+            for record in Journal.read(path):
+                if record.device_id in devices:
+                    if start is None:
+                        start = record.timestamp
+                    yield record.timestamp - start + offset, devices[record.device_id], record.data
+        self.add_source(frames())
+
+    def _pull(self, source: int):
+        for offset, device, frame in itertools.islice(self._sources[source], 1):
+            heapq.heappush(self._heap, (offset, next(self._sequence), device, _pack_frame(frame),
+                                        source))
+
+    def __len__(self):
+        return len(self._heap)
+
+    def run(self):
+        """
+        Send all scheduled frames, returns when there are none left or stop()
+        was called.
+        """
+        self._running = True
+        self._run()
+
+    def _run(self):
+        heap = self._heap
+        condition = self._condition
+        lateness = self._lateness
+        samples = len(lateness)
+        tick = self.tick
+        start = time.monotonic()
+        while True:
+            with condition:
+                if not heap or not self._running:
+                    break
+                due = start + heap[0][0]
+                remaining = due - time.monotonic()
+                if remaining > self._precise_sleep:
+                    # wakes up early for stop() and earlier frames
+                    condition.wait(remaining - self._precise_sleep)
+                    continue
+            if remaining > 0:
+                pew.sleep_until(due)
+            now = time.monotonic()
+            frames = {}  # type: Dict[Device, List[bytes]]
+            with condition:
+                if not self._running:
+                    break
+                while heap and start + heap[0][0] <= now + tick:
+                    offset, _, device, data, source = heapq.heappop(heap)
+                    frames.setdefault(device, []).append(data)
+                    lateness[self._sent % samples] = max(0.0, now - start - offset)
+                    self._sent += 1
+                    if source != -1:
+                        self._pull(source)
+            for device, data in frames.items():
+                device._write(b''.join(data))
+        self._running = False
+
+    def start(self) -> 'Scheduler':
+        """
+        Run in a background thread.
+        """
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='pewinput-scheduler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def lateness(self, percentiles: Iterable[float] = (50, 90, 99, 99.9)) -> Dict[str, float]:
+        """
+        How many seconds after their time the most recent frames were sent,
+        as percentiles, plus the overall number of sent frames.
+        """
+        stats = {f'p{p}': value
+                 for p, value in _percentiles(self._lateness, self._sent, percentiles).items()}
+        stats['max'] = max(self._lateness[:min(self._sent, len(self._lateness))], default=0.0)
+        stats['sent'] = self._sent
+        return stats
+
+
+def _split_frames(events: Frame) -> List[Frame]:
+    frames = []
+    frame = []  # type: Frame
+    for event in events:
+        if event[0] == EV_SYN:
+            if event[1] == SYN_REPORT.code:
+                frames.append(frame)
+                frame = []
+        else:
+            frame.append(event)
+    return frames
+
 
 INPUT_PROP_POINTER = 0x00
 INPUT_PROP_DIRECT = 0x01
@@ -187,6 +1897,8 @@ SYN_DROPPED = Event(EV_SYN, 3)
 SYN_MAX = Event(EV_SYN, 0xf)
 SYN_CNT = Event(EV_SYN, (SYN_MAX.code+1))
 
+_SYN_REPORT_PACKED = _input_event.pack(0, 0, EV_SYN, SYN_REPORT.code, 0)
+
 
 # Keys
 
@@ -961,6 +2673,9 @@ MSC_TIMESTAMP = Event(EV_MSC, 0x05)
 MSC_MAX = Event(EV_MSC, 0x07)
 MSC_CNT = Event(EV_MSC, (MSC_MAX.code+1))
 
+# type and code of an MSC_SERIAL event, as found in a packed struct input_event
+_probe_marker = struct.pack('HH', EV_MSC, MSC_SERIAL.code)
+
 
 # LEDs
 
@@ -994,3 +2709,54 @@ SND_BELL = Event(EV_SND, 0x01)
 SND_TONE = Event(EV_SND, 0x02)
 SND_MAX = Event(EV_SND, 0x07)
 SND_CNT = Event(EV_SND, (SND_MAX.code+1))
+
+
+# Capability profiles
+
+MOUSE_CAPABILITIES = Capabilities([BTN_LEFT, BTN_MIDDLE, BTN_RIGHT,
+                                   REL_X, REL_Y, REL_WHEEL, REL_HWHEEL])
+_MOUSE_AXES = (REL_X, REL_Y, REL_WHEEL, REL_HWHEEL)
+KEYBOARD_CAPABILITIES = Capabilities(
+    value for name, value in list(globals().items())
+    if name.startswith('KEY_') and isinstance(value, Key)
+    and name not in ('KEY_RESERVED', 'KEY_MIN_INTERESTING', 'KEY_MAX', 'KEY_CNT')
+)
+
+GAMEPAD_BUTTONS = [BTN_SOUTH, BTN_EAST, BTN_NORTH, BTN_WEST, BTN_TL, BTN_TR,
+                   BTN_SELECT, BTN_START, BTN_MODE, BTN_THUMBL, BTN_THUMBR]
+GAMEPAD_AXES = {
+    ABS_X: AbsInfo(-32768, 32767, 16, 128),
+    ABS_Y: AbsInfo(-32768, 32767, 16, 128),
+    ABS_RX: AbsInfo(-32768, 32767, 16, 128),
+    ABS_RY: AbsInfo(-32768, 32767, 16, 128),
+    ABS_Z: AbsInfo(0, 255),
+    ABS_RZ: AbsInfo(0, 255),
+    ABS_HAT0X: AbsInfo(-1, 1),
+    ABS_HAT0Y: AbsInfo(-1, 1),
+}
+
+JOYSTICK_BUTTONS = [BTN_TRIGGER, BTN_THUMB, BTN_THUMB2, BTN_TOP, BTN_TOP2, BTN_PINKIE,
+                    BTN_BASE, BTN_BASE2, BTN_BASE3, BTN_BASE4]
+JOYSTICK_AXES = {
+    ABS_X: AbsInfo(-32768, 32767, 16, 128),
+    ABS_Y: AbsInfo(-32768, 32767, 16, 128),
+    ABS_RZ: AbsInfo(-32768, 32767, 16, 128),
+    ABS_THROTTLE: AbsInfo(0, 255),
+    ABS_HAT0X: AbsInfo(-1, 1),
+    ABS_HAT0Y: AbsInfo(-1, 1),
+}
+
+# Key names for shortcuts
+_KEY_NAMES = {}  # type: Dict[str, Key]
+for _name, _value in list(globals().items()):
+    if isinstance(_value, Key) and _name.isupper():
+        _KEY_NAMES[_name.lower()] = _value
+        if _name.startswith('KEY_'):
+            _KEY_NAMES[_name[4:].lower()] = _value
+_KEY_NAMES.update({
+    'ctrl': KEY_LEFTCTRL, 'control': KEY_LEFTCTRL, 'shift': KEY_LEFTSHIFT, 'alt': KEY_LEFTALT,
+    'altgr': KEY_RIGHTALT, 'super': KEY_LEFTMETA, 'meta': KEY_LEFTMETA, 'win': KEY_LEFTMETA,
+    'return': KEY_ENTER, 'escape': KEY_ESC, 'del': KEY_DELETE, 'ins': KEY_INSERT,
+    'pgup': KEY_PAGEUP, 'pgdown': KEY_PAGEDOWN, 'plus': KEY_KPPLUS,
+})
+del _name, _value